@@ -4,30 +4,42 @@ MoodMate Final — webcam + stable emotion detection + Spotify playlist + nice U
 Save as moodmate_final.py and run in your venv:
 python moodmate_final.py
 """
-import pyttsx3
 import os
 import sys
 import cv2
 import time
 import random
 import threading
+import queue
 import collections
-import statistics
+import multiprocessing
 import webbrowser
 import subprocess
+from multiprocessing import shared_memory
 
-
-from PIL import Image, ImageTk
+import numpy as np
 import tkinter as tk
 from tkinter import ttk, messagebox
 
+# Let TensorFlow use the first GPU when one is present (must be set before deepface/TF import)
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "0")
+# Cap the CPU thread pools so they don't oversubscribe the cores: OpenCV's parallel_for_
+# here, ONNX Runtime via SessionOptions (OnnxEmotionModel) and TensorFlow's own pools via
+# tf.config.threading (_load_deepface). OMP_NUM_THREADS only reaches OpenMP-built kernels
+# such as MKL/oneDNN; the spawned analyzer process inherits it and re-runs this
+CPU_THREADS = 2
+os.environ.setdefault("OMP_NUM_THREADS", str(CPU_THREADS))
+cv2.setNumThreads(CPU_THREADS)
+
 # Optional libraries (best-effort imports)
-try:
-    from deepface import DeepFace
-    DEEPFACE_AVAILABLE = True
-except Exception as e:
-    print("DeepFace not available (demo fallback). Error:", e)
-    DEEPFACE_AVAILABLE = False
+# DeepFace (pulls in TensorFlow), onnxruntime and pyjokes are imported on first use
+# instead, see _load_deepface(), _load_onnxruntime() and get_joke(); None means "not tried yet"
+DeepFace = None
+DEEPFACE_AVAILABLE = None
+ort = None
+ORT_AVAILABLE = None
+pyjokes = None
+JOKES_AVAILABLE = None
 
 try:
     import pyttsx3
@@ -35,32 +47,35 @@ try:
 except Exception:
     TTS_AVAILABLE = False
 
-try:
-    import pyjokes
-    JOKES_AVAILABLE = True
-except Exception:
-    JOKES_AVAILABLE = False
-
 # ------------------ User Playlist ------------------
 PLAYLIST_URI = "spotify:playlist:3Qk05c3iAoUQiHRb5UdfFJ"
 PLAYLIST_WEB = "https://open.spotify.com/playlist/3Qk05c3iAoUQiHRb5UdfFJ?si=1e9c450a87684da5&autoplay=true"
 
+# ------------------ Video config ------------------
+VIDEO_PAD = 18              # padding around the video inside the left pane
+CAMERA_SIZE = (640, 480)    # capture resolution requested from the webcam
+DEFAULT_FPS = 30            # used when the camera does not report a sane frame rate
+SMALL_PREVIEW_HEIGHT = 480  # below this preview height only every other frame is drawn
 
 # ------------------ Detection config ------------------
 ANALYZE_INTERVAL = 1.0      # seconds between model calls
+BATCH_SIZE = 8              # face crops sampled per model call, classified in one batch
+SAMPLE_INTERVAL = ANALYZE_INTERVAL / BATCH_SIZE
+WORKER_RESTARTS = 3         # analyzer process restarts before falling back to demo mode
+ERROR_LOG_INTERVAL = 10.0   # seconds between repeats of the same analyzer error message
 ROLLING_WINDOW = 7          # frames to keep for smoothing
 STABLE_THRESHOLD = 3        # mode must appear this many times to be stable
+EMOTION_INPUT_SIZE = (48, 48)  # grayscale input of the DeepFace emotion CNN
+DETECT_SIZE = (320, 240)    # frames are downscaled to this for the face pre-filter
 
-# map raw emotions to categories + emojis
-EMOTION_MAP = {
-    'happy': 'happy',
-    'sad': 'sad',
-    'neutral': 'neutral',
-    'angry': 'angry',
-    'surprise': 'surprise',
-    'fear': 'fear',
-    'disgust': 'disgust'
-}
+# exported emotion model (python moodmate_final.py --export-onnx); used instead of Keras when present
+EMOTION_ONNX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emotion.onnx")
+EMOTION_ONNX_INT8 = os.path.splitext(EMOTION_ONNX)[0] + ".int8.onnx"
+# optional YuNet face detector (opencv_zoo face_detection_yunet); Haar cascade is used otherwise
+YUNET_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "face_detection_yunet.onnx")
+
+# class ids are indices into the DeepFace emotion model output
+CLASS_NAMES = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
 
 EMOJI = {
     'happy': "😄",
@@ -88,22 +103,61 @@ FALLBACK_JOKES = [
     "Why did the scarecrow win an award? Because he was outstanding in his field!"
 ]
 
+# per-class-id lookups, so predictions can stay plain ints end to end
+EMOJI_BY_ID = tuple(EMOJI[n] for n in CLASS_NAMES)
+MOOD_TEXT_BY_ID = tuple(MOOD_TEXT[n] for n in CLASS_NAMES)
+
 # ------------------ Utilities ------------------
+_tts_queue = queue.Queue()
+_tts_thread = None
+
+def _tts_loop():
+    """Own the single pyttsx3 engine and speak queued texts one after another."""
+    try:
+        engine = pyttsx3.init()
+    except Exception as e:
+        print("TTS error:", e)
+        engine = None
+    while True:
+        text = _tts_queue.get()
+        if engine is None:
+            print("[TTS]", text)
+            continue
+        try:
+            engine.say(text)
+            engine.runAndWait()
+        except Exception as e:
+            print("TTS error:", e)
+            print("[TTS]", text)
+
 def speak(text):
     """Speak using pyttsx3 if available, otherwise print to console."""
+    global _tts_thread
     if TTS_AVAILABLE:
-        def _s():
-            try:
-                engine = pyttsx3.init()
-                engine.say(text)
-                engine.runAndWait()
-            except Exception as e:
-                print("TTS error:", e)
-                print("[TTS]", text)
-        threading.Thread(target=_s, daemon=True).start()
+        # one engine on one worker thread; init is paid once, not per utterance
+        if _tts_thread is None:
+            _tts_thread = threading.Thread(target=_tts_loop, daemon=True)
+            _tts_thread.start()
+        _tts_queue.put(text)
     else:
         print("[TTS disabled] " + text)
 
+def get_joke():
+    """Return a pyjokes joke (imported on first call) or one of the fallback jokes."""
+    global pyjokes, JOKES_AVAILABLE
+    if JOKES_AVAILABLE is None:
+        try:
+            import pyjokes
+            JOKES_AVAILABLE = True
+        except Exception:
+            JOKES_AVAILABLE = False
+    if JOKES_AVAILABLE:
+        try:
+            return pyjokes.get_joke()
+        except Exception:
+            pass
+    return random.choice(FALLBACK_JOKES)
+
 def open_spotify(uri=PLAYLIST_URI, web=PLAYLIST_WEB):
     """Attempt to open Spotify desktop via URI; fallback to web URL with autoplay."""
     try:
@@ -122,71 +176,515 @@ def open_spotify(uri=PLAYLIST_URI, web=PLAYLIST_WEB):
         autoplay_url = web + "&autoplay=true"
         webbrowser.open(autoplay_url)
 
-def speak_message(message):
-    """Make the assistant speak a message aloud."""
-    engine.say(message)
-    engine.runAndWait()
 
+# ------------------ Emotion Model ------------------
+class OnnxEmotionModel:
+    """Exported emotion CNN run through ONNX Runtime (TensorRT/CUDA when installed, else CPU)."""
+    def __init__(self, path):
+        preferred = [
+            ("TensorrtExecutionProvider", {"trt_fp16_enable": True}),
+            "CUDAExecutionProvider",
+            "CPUExecutionProvider",
+        ]
+        available = ort.get_available_providers()
+        providers = [p for p in preferred if (p[0] if isinstance(p, tuple) else p) in available]
+        # ORT sizes its own pools and ignores OMP_NUM_THREADS; one op at a time is enough here
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = CPU_THREADS
+        options.inter_op_num_threads = 1
+        self.sess = ort.InferenceSession(path, sess_options=options, providers=providers)
+        self.input_name = self.sess.get_inputs()[0].name
+
+    def predict(self, x, verbose=0):
+        # same call shape as keras Model.predict so the analyzer can use either backend
+        return self.sess.run(None, {self.input_name: x})[0]
+
+def _load_onnxruntime():
+    """Import onnxruntime on first use; only the analyzer worker process needs it."""
+    global ort, ORT_AVAILABLE
+    if ORT_AVAILABLE is None:
+        try:
+            import onnxruntime as ort
+            ORT_AVAILABLE = True
+        except Exception:
+            ORT_AVAILABLE = False
+    return ort
+
+def _limit_tensorflow_threads():
+    # TensorFlow uses its own Eigen pools (not OpenMP) sized to all cores by default
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(CPU_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError as e:
+        # only possible before TensorFlow has initialised its runtime
+        print("Cannot limit TensorFlow threads:", e)
+
+def _load_deepface():
+    """Import DeepFace on first use so TensorFlow never loads in the GUI process."""
+    global DeepFace, DEEPFACE_AVAILABLE
+    if DEEPFACE_AVAILABLE is None:
+        try:
+            from deepface import DeepFace
+            DEEPFACE_AVAILABLE = True
+            _limit_tensorflow_threads()
+        except Exception as e:
+            print("DeepFace not available (demo fallback). Error:", e)
+            DEEPFACE_AVAILABLE = False
+    return DeepFace
+
+def _build_keras_emotion_model():
+    if _load_deepface() is None:
+        raise RuntimeError("DeepFace is not installed")
+    try:
+        client = DeepFace.build_model(model_name="Emotion", task="facial_attribute")
+    except TypeError:
+        # older deepface releases have no task argument
+        client = DeepFace.build_model("Emotion")
+    return getattr(client, "model", client)
+
+_emotion_model = None
+_emotion_model_lock = threading.Lock()
+
+def get_emotion_model():
+    """Build the emotion model once and return it (None when no backend is available).
+
+    The INT8 ONNX export is preferred, then the FP32 export, then the DeepFace Keras model.
+    Each candidate is built on its own; one that fails to load is logged and the next is tried.
+    """
+    global _emotion_model
+    with _emotion_model_lock:
+        if _emotion_model is None:
+            exports = [p for p in (EMOTION_ONNX_INT8, EMOTION_ONNX) if os.path.exists(p)]
+            if exports and _load_onnxruntime() is not None:
+                for path in exports:
+                    try:
+                        _emotion_model = OnnxEmotionModel(path)
+                        break
+                    except Exception as e:
+                        print("Cannot load", path, "-> trying next emotion model:", e)
+            if _emotion_model is None and _load_deepface() is not None:
+                try:
+                    _emotion_model = _build_keras_emotion_model()
+                except Exception as e:
+                    print("Cannot build DeepFace emotion model:", e)
+        return _emotion_model
+
+def export_emotion_onnx(path=EMOTION_ONNX):
+    """Export the DeepFace emotion CNN to ONNX, plus a dynamically quantized INT8 copy.
+
+    Needs tensorflow, tf2onnx and onnxruntime; run once with
+    ``python moodmate_final.py --export-onnx``.
+    """
+    import tensorflow as tf
+    import tf2onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model = _build_keras_emotion_model()
+    spec = (tf.TensorSpec((None,) + EMOTION_INPUT_SIZE + (1,), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=path)
+    int8_path = os.path.splitext(path)[0] + ".int8.onnx"
+    quantize_dynamic(path, int8_path, weight_type=QuantType.QUInt8)
+    print("Exported emotion model to", path, "and", int8_path)
+
+
+# ------------------ Camera Thread ------------------
+def open_camera(index=0):
+    """Open the webcam on the native backend and ask for MJPEG at CAMERA_SIZE."""
+    if sys.platform.startswith("win"):
+        backend = cv2.CAP_DSHOW
+    elif sys.platform.startswith("linux"):
+        backend = cv2.CAP_V4L2
+    else:
+        backend = cv2.CAP_ANY
+    cap = cv2.VideoCapture(index, backend)
+    if not cap.isOpened():
+        # fallback to whatever backend OpenCV picks by default
+        cap.release()
+        cap = cv2.VideoCapture(index)
+    # MJPEG frames need far less USB bandwidth than raw YUY2; cameras without it ignore this
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_SIZE[0])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_SIZE[1])
+    return cap
+
+class CameraThread(threading.Thread):
+    """Only reader of the webcam; GUI and analyzer share the latest frame from here."""
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.lock = threading.Lock()
+        self.new_frame = threading.Event()
+        self.latest = None
+        self.running = True
+
+    def run(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.05)
+                continue
+            # cap.read() returns a fresh array every call, so readers can keep
+            # the published frame without copying it
+            with self.lock:
+                self.latest = frame
+            self.new_frame.set()
+
+    def get_latest(self):
+        with self.lock:
+            return self.latest
+
+    def stop(self):
+        self.running = False
+
+# ------------------ Emotion Analyzer ------------------
+class RollingCounter:
+    """Last `maxlen` predictions with per-label counts kept up to date on every append."""
+    def __init__(self, maxlen):
+        self.items = collections.deque(maxlen=maxlen)
+        self.counts = collections.Counter()
+
+    def append(self, item):
+        if len(self.items) == self.items.maxlen:
+            old = self.items[0]
+            self.counts[old] -= 1
+            if not self.counts[old]:
+                del self.counts[old]
+        self.items.append(item)
+        self.counts[item] += 1
+
+    def clear(self):
+        self.items.clear()
+        self.counts.clear()
+
+    def stable_mode(self, threshold):
+        """Most common item if it appears at least `threshold` times, else None (never raises)."""
+        most = self.counts.most_common(1)
+        return most[0][0] if most and most[0][1] >= threshold else None
+
+class EmotionPredictor:
+    """Face pre-filter + emotion CNN; lives in the analyzer worker process."""
+    def __init__(self):
+        self._emotion_model = None
+        # reused model input batch (batch, h, w, channel); face crops are written in as they arrive
+        self._batch = np.empty((BATCH_SIZE,) + EMOTION_INPUT_SIZE + (1,), np.float32)
+        self._count = 0
+        # uint8 48x48 scratch image the face crop is resized into
+        self._face = np.empty(EMOTION_INPUT_SIZE[::-1], np.uint8)
+        self._yunet = None
+        if hasattr(cv2, "FaceDetectorYN") and os.path.exists(YUNET_MODEL):
+            try:
+                self._yunet = cv2.FaceDetectorYN.create(YUNET_MODEL, "", DETECT_SIZE)
+            except cv2.error as e:
+                print("Cannot load YuNet face detector -> using Haar cascade:", e)
+        # some distro/conda OpenCV builds ship without cv2.data
+        cascade_dir = getattr(getattr(cv2, "data", None), "haarcascades", "")
+        self._face_cascade = cv2.CascadeClassifier(
+            os.path.join(cascade_dir, "haarcascade_frontalface_default.xml"))
+        if self._yunet is None and self._face_cascade.empty():
+            print("No face detector available -> no faces will be detected")
+
+    def warm_up(self):
+        """Load the emotion model and run one dummy predict so the first real call is fast."""
+        try:
+            model = get_emotion_model()
+            if model is None:
+                return
+            self._batch.fill(0)
+            model.predict(self._batch, verbose=0)
+            self._emotion_model = model
+        except Exception as e:
+            print("Emotion model load error -> fallback to demo:", e)
+
+    def backend_name(self):
+        """Name of the backend predict() uses: "ONNX", "Keras" or "demo"."""
+        if self._emotion_model is None:
+            return "demo"
+        return "ONNX" if isinstance(self._emotion_model, OnnxEmotionModel) else "Keras"
+
+    def _detect_face(self, frame_bgr):
+        """Return the largest face as (x0, y0, x1, y1) in frame pixels, or None."""
+        fh, fw = frame_bgr.shape[:2]
+        small = cv2.resize(frame_bgr, DETECT_SIZE, interpolation=cv2.INTER_AREA)
+        if self._yunet is not None:
+            _, faces = self._yunet.detect(small)
+            boxes = [] if faces is None else faces[:, :4]
+        elif self._face_cascade.empty():
+            # detectMultiScale on an empty classifier raises; report "no face" instead
+            return None
+        else:
+            gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            boxes = self._face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+        if len(boxes) == 0:
+            return None
+        x, y, w, h = max(boxes, key=lambda b: b[2] * b[3])
+        sx, sy = fw / DETECT_SIZE[0], fh / DETECT_SIZE[1]
+        x0, y0 = max(0, int(x * sx)), max(0, int(y * sy))
+        x1, y1 = min(fw, int((x + w) * sx)), min(fh, int((y + h) * sy))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1, y1
+
+    def add_frame(self, frame_bgr):
+        """Queue the face crop of a BGR frame for the next batch; frames without a face are dropped."""
+        if self._emotion_model is None:
+            # demo mode has nothing to crop
+            self._count += 1
+            return
+        # cheap face pre-filter on a downscaled frame; the CNN only sees face crops.
+        # _detect_face only returns non-empty, in-bounds boxes; OpenCV errors propagate
+        # to the worker loop, which skips the frame
+        box = self._detect_face(frame_bgr)
+        if box is None:
+            return
+        x0, y0, x1, y1 = box
+        # the model's whole preprocessing: one gray conversion of the crop, one resize
+        # to 48x48 and a /255 scale written straight into the batch (no DeepFace pipeline)
+        gray = cv2.cvtColor(frame_bgr[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        cv2.resize(gray, EMOTION_INPUT_SIZE, dst=self._face, interpolation=cv2.INTER_AREA)
+        # ring of BATCH_SIZE slots: the newest crops win
+        np.multiply(self._face, 1.0 / 255, out=self._batch[self._count % BATCH_SIZE, :, :, 0])
+        self._count += 1
+
+    def predict(self):
+        """Classify the queued crops in one batch; returns None when no face was seen.
+
+        Model errors (including an unexpected output shape) raise; the worker loop drops the batch.
+        """
+        n = min(self._count, BATCH_SIZE)
+        self._count = 0
+        if n == 0:
+            return None
+        if self._emotion_model is None:
+            # Demo fallback: random class id
+            return random.randrange(len(CLASS_NAMES))
+        # always the full batch: a fixed input shape keeps TensorRT (and Keras'
+        # traced graph) from rebuilding for every new face count; unused rows are ignored
+        probs = np.asarray(self._emotion_model.predict(self._batch, verbose=0))
+        if probs.shape != (BATCH_SIZE, len(CLASS_NAMES)):
+            raise ValueError("unexpected emotion model output shape %s" % (probs.shape,))
+        # averaging softmax over the filled rows also smooths single-frame noise
+        return int(np.argmax(probs[:n].mean(axis=0)))
+
+class ThrottledLog:
+    """Print repeated errors at most once per interval, with a count of the suppressed ones."""
+    def __init__(self, interval=ERROR_LOG_INTERVAL):
+        self.interval = interval
+        self._next = {}
+        self._suppressed = {}
+
+    def error(self, label, e):
+        now = time.monotonic()
+        if now < self._next.get(label, 0.0):
+            self._suppressed[label] = self._suppressed.get(label, 0) + 1
+            return
+        self._next[label] = now + self.interval
+        skipped = self._suppressed.pop(label, 0)
+        if skipped:
+            print("%s: %s (%d similar errors suppressed)" % (label, e, skipped))
+        else:
+            print("%s: %s" % (label, e))
+
+def _analyzer_worker(shm_name, shape, frame_lock, frame_ready, stop_event, results):
+    """Analyzer process: collect face crops from shared-memory frames, classify them once per interval."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    shared = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    frame = np.empty(shape, dtype=np.uint8)
+    predictor = EmotionPredictor()
+    predictor.warm_up()
+    log = ThrottledLog()
+    # one-off report for the GUI status line; predictions that follow are class ids
+    results.put(predictor.backend_name())
+    next_predict = time.monotonic() + ANALYZE_INTERVAL
+    try:
+        while not stop_event.is_set():
+            if frame_ready.wait(timeout=SAMPLE_INTERVAL):
+                frame_ready.clear()
+                if stop_event.is_set():
+                    break
+                with frame_lock:
+                    np.copyto(frame, shared)
+                # the only error guard for frames and batches: a failure skips that frame
+                # (or casts no vote) and is logged rate-limited, since it tends to repeat
+                try:
+                    predictor.add_frame(frame)
+                except Exception as e:
+                    log.error("Face detection error -> skipping frame", e)
+            now = time.monotonic()
+            if now < next_predict:
+                continue
+            next_predict = now + ANALYZE_INTERVAL
+            try:
+                pred = predictor.predict()
+            except Exception as e:
+                log.error("Emotion predict error -> skipping batch", e)
+                continue
+            if pred is None:
+                continue
+            # keep only the newest result
+            try:
+                stale = results.get_nowait()
+            except queue.Empty:
+                stale = None
+            if isinstance(stale, str):
+                # the GUI has not read the backend report yet: it wins over this prediction
+                results.put(stale)
+                continue
+            results.put(pred)
+    finally:
+        del shared
+        shm.close()
 
-# ------------------ Emotion Analyzer Thread ------------------
 class EmotionAnalyzer(threading.Thread):
+    """GUI-side analyzer: feeds frames to the worker process and smooths its predictions.
+
+    TensorFlow runs in its own process (own GIL), so inference never stalls the Tk loop.
+    Frames go through shared memory instead of being pickled.
+    """
     def __init__(self, frame_provider):
         super().__init__(daemon=True)
         self.get_frame = frame_provider
-        self.window = collections.deque(maxlen=ROLLING_WINDOW)
+        self.window = RollingCounter(ROLLING_WINDOW)
         self.lock = threading.Lock()
         self.running = True
         self.paused = False
         self.stable_emotion = None
+        # status line for the GUI (read from the Tk thread via get_status)
+        self.status = None
+        self._ctx = multiprocessing.get_context("spawn")
+        # worker IPC objects, (re)created per worker in _start_worker
+        self._results = self._ctx.Queue(maxsize=1)
+        self._frame_lock = None
+        self._frame_ready = None
+        self._stop_event = None
+        self._shm = None
+        self._shared = None
+        self._proc = None
+        self._restarts = 0
+        self._demo = False
+
+    def _start_worker(self):
+        # fresh queue, lock and events: a killed worker can leave the old ones unusable
+        # (e.g. still registered as a waiter on the Event's Condition, so set() would block)
+        self._results = self._ctx.Queue(maxsize=1)
+        self._frame_lock = self._ctx.Lock()
+        self._frame_ready = self._ctx.Event()
+        self._stop_event = self._ctx.Event()
+        self._proc = self._ctx.Process(
+            target=_analyzer_worker, daemon=True,
+            args=(self._shm.name, self._shared.shape, self._frame_lock, self._frame_ready,
+                  self._stop_event, self._results))
+        self._proc.start()
+
+    def _check_worker(self):
+        """Restart a dead worker; after WORKER_RESTARTS failures fall back to demo mode."""
+        if self._proc is None or self._proc.is_alive():
+            return
+        print("Emotion analyzer process exited with code", self._proc.exitcode)
+        if self._restarts < WORKER_RESTARTS:
+            self._restarts += 1
+            self._set_status("Status: Emotion analyzer stopped, restarting...")
+            self._start_worker()
+        else:
+            self._proc = None
+            self._demo = True
+            self._set_status("Status: Emotion analyzer failed, demo mode (random moods)")
+
+    def _publish(self, frame):
+        # the shared buffer and worker are created lazily, sized to the first frame
+        if self._shm is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+            self._shared = np.ndarray(frame.shape, dtype=np.uint8, buffer=self._shm.buf)
+            self._start_worker()
+        if frame.shape != self._shared.shape:
+            frame = cv2.resize(frame, (self._shared.shape[1], self._shared.shape[0]))
+        # a worker killed mid-copy can leave the lock held; skip the frame rather than hang
+        if not self._frame_lock.acquire(timeout=0.5):
+            return
+        try:
+            np.copyto(self._shared, frame)
+        finally:
+            self._frame_lock.release()
+        # never signal an Event a dead worker may still be waiting on; _check_worker restarts it
+        if self._proc is not None and self._proc.is_alive():
+            self._frame_ready.set()
+
+    def _drain(self):
+        try:
+            while True:
+                msg = self._results.get_nowait()
+                # stale predictions are dropped, but the backend report is still news
+                if isinstance(msg, str):
+                    self._set_backend(msg)
+        except queue.Empty:
+            pass
+
+    def _shutdown_worker(self):
+        if self._proc is not None and self._proc.is_alive():
+            self._stop_event.set()
+            self._frame_ready.set()
+            self._proc.join(timeout=2.0)
+        if self._shm is not None:
+            self._shared = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
 
     def run(self):
+        try:
+            self._loop()
+        finally:
+            # this thread owns the shared buffer, so it also releases it
+            self._shutdown_worker()
+
+    def _loop(self):
         while self.running:
             if self.paused:
                 time.sleep(0.15)
                 continue
-            frame = self.get_frame()
-            if frame is None:
-                time.sleep(0.15)
+            if self._demo:
+                # Demo fallback: random class id
+                self._add_prediction(random.randrange(len(CLASS_NAMES)))
+                time.sleep(ANALYZE_INTERVAL)
                 continue
-            pred = self._predict(frame)
-            with self.lock:
-                self.window.append(pred)
-                mode_val = None
-                try:
-                    mode_val = statistics.mode(list(self.window))
-                except Exception:
-                    mode_val = None
-                if mode_val:
-                    count_mode = sum(1 for x in self.window if x == mode_val)
-                    if count_mode >= STABLE_THRESHOLD:
-                        self.stable_emotion = mode_val
-            time.sleep(ANALYZE_INTERVAL)
-
-    def _predict(self, frame_bgr):
-        # frame_bgr: BGR numpy array from OpenCV
-        if DEEPFACE_AVAILABLE:
+            self._check_worker()
+            if self._demo:
+                continue
+            frame = self.get_frame()
+            if frame is not None:
+                # the worker samples a few frames per interval and classifies them as one batch
+                self._publish(frame)
             try:
-                # DeepFace prefers RGB for many wrappers; convert to RGB
-                rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-                res = DeepFace.analyze(rgb, actions=['emotion'], enforce_detection=False)
-                if isinstance(res, list):
-                    res = res[0]
-                # Try multiple keys depending on version
-                dom = res.get('dominant_emotion') or res.get('dominant_emotion', None)
-                if not dom:
-                    # sometimes result has 'emotion' dict
-                    emdict = res.get('emotion', {})
-                    if emdict:
-                        dom = max(emdict, key=emdict.get)
-                if dom:
-                    dom_l = dom.lower()
-                    mapped = EMOTION_MAP.get(dom_l, 'neutral')
-                    return mapped
-            except Exception as e:
-                print("DeepFace analyze error -> fallback to demo:", e)
-                return random.choice(list(EMOJI.keys()))
-        # Demo fallback: random stable choice (but chosen from MOOD_TEXT keys)
-        return random.choice(list(MOOD_TEXT.keys()))
+                msg = self._results.get_nowait()
+            except queue.Empty:
+                msg = None
+            if isinstance(msg, str):
+                self._set_backend(msg)
+            elif msg is not None:
+                self._add_prediction(msg)
+            time.sleep(SAMPLE_INTERVAL)
+
+    def _set_backend(self, backend):
+        # sent once by each (re)started worker after loading its model
+        if backend == "demo":
+            self._set_status("Status: No emotion model, demo mode (random moods)")
+        else:
+            self._set_status("Status: Detection running (%s)" % backend)
+
+    def _add_prediction(self, pred):
+        with self.lock:
+            self.window.append(pred)
+            mode_val = self.window.stable_mode(STABLE_THRESHOLD)
+            if mode_val is not None:
+                self.stable_emotion = mode_val
+
+    def _set_status(self, text):
+        with self.lock:
+            self.status = text
+
+    def get_status(self):
+        with self.lock:
+            return self.status
 
     def get_stable(self):
         with self.lock:
@@ -201,9 +699,14 @@ class EmotionAnalyzer(threading.Thread):
             self.paused = False
             self.window.clear()
             self.stable_emotion = None
+        # results computed before the pause are stale
+        self._drain()
 
     def stop(self):
         self.running = False
+        # wait for run() to stop the worker and free shared memory before the app exits
+        if self.is_alive():
+            self.join(timeout=4.0)
 
 # ------------------ Main GUI App ------------------
 class MoodMateApp:
@@ -230,7 +733,13 @@ class MoodMateApp:
 
         # Video label
         self.video_label = tk.Label(self.left, bg="#000000")
-        self.video_label.pack(fill=tk.BOTH, expand=True, padx=18, pady=18)
+        self.video_label.pack(fill=tk.BOTH, expand=True, padx=VIDEO_PAD, pady=VIDEO_PAD)
+        # cached video size; refreshed only when the left pane is resized
+        self._frame_wh = (200, 150)
+        self.left.bind("<Configure>", self._on_left_resize)
+        # one photo image reused for every frame; pixels are swapped in as PPM data
+        self._photo = tk.PhotoImage(width=self._frame_wh[0], height=self._frame_wh[1])
+        self.video_label.config(image=self._photo)
 
         # Right: emoji + text + buttons
         ttk.Label(self.right, text="MoodMate", style="Title.TLabel").pack(pady=(20,6))
@@ -257,11 +766,21 @@ class MoodMateApp:
         self.status_label.place(relx=0.02, rely=0.94)
 
         # Setup camera
-        self.cap = cv2.VideoCapture(0)
+        self.cap = open_camera(0)
         if not self.cap.isOpened():
             messagebox.showerror("Camera error", "Cannot access webcam. Close other apps and try again.")
             root.destroy()
             return
+        self.camera = CameraThread(self.cap)
+        self.camera.start()
+        # pace the preview to the camera instead of a fixed 30 ms
+        fps = self.cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        if not 1 <= fps <= 120:
+            fps = DEFAULT_FPS
+        self._frame_period = 1.0 / fps
+        self._next_tick = time.monotonic()
+        self._last_frame = None
+        self._frame_count = 0
 
         # Analyzer thread
         self.analyzer = EmotionAnalyzer(self.get_frame_for_analyzer)
@@ -269,37 +788,66 @@ class MoodMateApp:
 
         self.current_displayed = None
         self.last_trigger = 0
+        self._analyzer_status = None
 
         # start loops
         self.update_video()
         self.check_stable_periodic()
 
     def get_frame_for_analyzer(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        # wait for a frame captured after the previous analysis
+        if not self.camera.new_frame.wait(timeout=0.5):
             return None
-        # use original (non-mirrored) for analysis
-        return frame.copy()
+        self.camera.new_frame.clear()
+        # use original (non-mirrored) for analysis; frames are never modified in place
+        return self.camera.get_latest()
+
+    def _on_left_resize(self, event):
+        # event carries the new size, so no winfo_* round-trip to Tcl is needed
+        wh = (max(200, event.width - 2 * VIDEO_PAD), max(150, event.height - 2 * VIDEO_PAD))
+        if wh == self._frame_wh:
+            # <Configure> also fires on moves; nothing to do when the size is unchanged
+            return
+        self._frame_wh = wh
+        self._photo.configure(width=wh[0], height=wh[1])
+
+    def _render_frame(self, frame):
+        # scale to left frame size before color conversion (fewer bytes to convert)
+        small = cv2.resize(frame, self._frame_wh, interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        # raw PPM (P6) lets Tk take the RGB bytes directly, no PIL encode step
+        w, h = self._frame_wh
+        header = f"P6\n{w} {h}\n255\n".encode()
+        # mirror for natural user view: tobytes() on the reversed view is the
+        # only copy, instead of a separate cv2.flip buffer on the full frame
+        self._photo.configure(data=header + rgb[:, ::-1].tobytes(), format="PPM")
 
     def update_video(self):
-        ret, frame = self.cap.read()
-        if ret:
-            # mirror for natural user view
-            frame = cv2.flip(frame, 1)
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(rgb)
-            # scale to left frame size
-            w = max(200, int(self.left.winfo_width() - 36))
-            h = max(150, int(self.left.winfo_height() - 36))
-            img = img.resize((w, h))
-            imgtk = ImageTk.PhotoImage(img)
-            self.video_label.imgtk = imgtk
-            self.video_label.config(image=imgtk)
-        self.root.after(30, self.update_video)
+        now = time.monotonic()
+        # more than a frame late (e.g. a busy GUI thread): skip this render and
+        # resync rather than queueing callbacks to catch up
+        behind = now - self._next_tick > self._frame_period
+        frame = self.camera.get_latest()
+        # every capture is a new array, so identity tells whether it was drawn already
+        if not behind and frame is not None and frame is not self._last_frame:
+            self._last_frame = frame
+            self._frame_count += 1
+            # small preview: drawing every other frame is not noticeable and halves GUI work
+            if self._frame_wh[1] >= SMALL_PREVIEW_HEIGHT or self._frame_count % 2 == 0:
+                self._render_frame(frame)
+        # schedule against absolute deadlines so the interval does not drift
+        self._next_tick = (now if behind else self._next_tick) + self._frame_period
+        delay_ms = max(0, int((self._next_tick - time.monotonic()) * 1000))
+        self.root.after(delay_ms, self.update_video)
 
     def check_stable_periodic(self):
+        # surface analyzer state changes (worker up, restarting, demo fallback)
+        status = self.analyzer.get_status()
+        if status is not None and status != self._analyzer_status:
+            self._analyzer_status = status
+            self.status_label.config(text=status)
         stable = self.analyzer.get_stable()
-        if stable and stable != self.current_displayed:
+        if stable is not None and stable != self.current_displayed:
             now = time.time()
             if now - self.last_trigger > 1.0:
                 self.current_displayed = stable
@@ -307,9 +855,10 @@ class MoodMateApp:
                 self.last_trigger = now
         self.root.after(600, self.check_stable_periodic)
 
-    def on_new_emotion(self, mood):
-        emoji = EMOJI.get(mood, "😐")
-        title, subtitle = MOOD_TEXT.get(mood, MOOD_TEXT['neutral'])
+    def on_new_emotion(self, mood_id):
+        mood = CLASS_NAMES[mood_id]
+        emoji = EMOJI_BY_ID[mood_id]
+        title, subtitle = MOOD_TEXT_BY_ID[mood_id]
         self.emoji_lbl.config(text=emoji)
         self.title_lbl.config(text=title)
         self.subtitle_lbl.config(text=subtitle)
@@ -319,10 +868,11 @@ class MoodMateApp:
         # pause analyzer so it doesn't keep popping up dialogs
         self.analyzer.pause()
         # show suggestions dialog
-        self.show_suggestion_dialog(mood)
+        self.show_suggestion_dialog(mood_id)
 
-    def show_suggestion_dialog(self, mood):
-        meta_title, meta_sub = MOOD_TEXT.get(mood, MOOD_TEXT['neutral'])
+    def show_suggestion_dialog(self, mood_id):
+        mood = CLASS_NAMES[mood_id]
+        meta_title, meta_sub = MOOD_TEXT_BY_ID[mood_id]
         win = tk.Toplevel(self.root)
         win.title("Suggestions")
         win.state("zoomed")
@@ -385,13 +935,7 @@ class MoodMateApp:
 
     # ---------- Joke window (cartoon) ----------
     def show_joke_window(self):
-        if JOKES_AVAILABLE:
-            try:
-                joke = pyjokes.get_joke()
-            except Exception:
-                joke = random.choice(FALLBACK_JOKES)
-        else:
-            joke = random.choice(FALLBACK_JOKES)
+        joke = get_joke()
 
         jw = tk.Toplevel(self.root)
         jw.title("A little laugh")
@@ -485,6 +1029,8 @@ class MoodMateApp:
         except Exception:
             pass
         try:
+            self.camera.stop()
+            self.camera.join(timeout=1.0)
             self.cap.release()
         except Exception:
             pass
@@ -492,6 +1038,9 @@ class MoodMateApp:
 
 # ------------------ Run ------------------
 def main():
+    if "--export-onnx" in sys.argv:
+        export_emotion_onnx()
+        return
     root = tk.Tk()
     app = MoodMateApp(root)
     root.protocol("WM_DELETE_WINDOW", app.close)